@@ -5,17 +5,40 @@ Analyzes venue images to extract energy levels and vibe tags
 
 import asyncio
 import base64
-import json
+import hashlib
 import os
-from dataclasses import dataclass
+import re
+import sys
+from dataclasses import asdict, dataclass, replace
+from io import BytesIO
 from typing import Optional
 
 import httpx
-from anthropic import Anthropic
+import imagehash
+import orjson
+from aiolimiter import AsyncLimiter
+from anthropic import AsyncAnthropic, BadRequestError, RateLimitError
 from dotenv import load_dotenv
+from PIL import Image, UnidentifiedImageError
+
+# Add project root to path so this module also runs as a standalone script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from scout_engine.utils.cache import AnalysisCache
+from scout_engine.utils.rate_limit import AdaptiveConcurrency
 
 load_dotenv()
 
+# Pre-filter thresholds: images smaller than this (px) or with a narrower
+# grayscale range are logos/flyers/UI, and perceptual hashes this close
+# are treated as the same picture
+MIN_IMAGE_SIDE = 32
+MIN_DYNAMIC_RANGE = 24
+PHASH_MAX_DISTANCE = 6
+
+# Leading/trailing markdown code fence the model sometimes wraps its JSON in
+_FENCE_RE = re.compile(r"^\s*```(?:json)?\s*\n?|\n?\s*```\s*$", re.DOTALL)
+
 
 @dataclass
 class VibeAnalysis:
@@ -53,152 +76,526 @@ Scoring guide:
 If the image is not of a venue/party scene, still provide your best guess but set confidence low.
 Respond with ONLY the JSON object, nothing else."""
 
-    def __init__(self, api_key: Optional[str] = None):
+    # Answers are ~80-120 tokens per image; a tight cap stops runaway responses early
+    MAX_TOKENS_PER_IMAGE = 160
+
+    MULTI_VIBE_PROMPT = """You are analyzing social media images/thumbnails from a nightlife venue to determine the current vibe and energy.
+
+Analyze each image separately and respond with ONLY a JSON array (no markdown, no explanation) containing exactly one object per image, in the same order as the images, each in this exact format:
+{
+    "energy_level": <1-10 integer>,
+    "crowd_level": <1-10 integer>,
+    "vibe_tags": [<list of 2-4 descriptive tags>],
+    "description": "<one sentence describing the scene>",
+    "confidence": <0.0-1.0 float>
+}
+
+Scoring guide:
+- energy_level: 1=empty/dead, 5=moderate activity, 10=absolutely packed and wild
+- crowd_level: 1=empty, 5=half capacity, 10=shoulder to shoulder
+- vibe_tags: Choose from or similar to: "Techno", "House", "Hip-Hop", "Latin", "Chill", "Hype", "Dark", "Bright", "Intimate", "Massive", "VIP", "Underground", "Mainstream", "Live Music", "DJ Set", "Dancing", "Lounge"
+- confidence: How confident you are in this assessment (low if image is blurry, unclear, or not of a venue)
+
+If an image is not of a venue/party scene, still provide your best guess for it but set confidence low.
+Respond with ONLY the JSON array, nothing else."""
+
+    def __init__(self, api_key: Optional[str] = None, cache_path: Optional[str] = None):
         self.api_key = api_key or os.getenv("ANTHROPIC_API_KEY")
         if not self.api_key:
             raise ValueError(
                 "ANTHROPIC_API_KEY not found. Set it in .env or pass api_key parameter. "
                 "Get your key at: https://console.anthropic.com/settings/keys"
             )
-        self.client = Anthropic(api_key=self.api_key)
-
-    async def _fetch_image_as_base64(self, image_url: str) -> tuple[str, str]:
-        """Fetch an image and convert to base64"""
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                image_url,
-                headers={
-                    "User-Agent": (
-                        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
-                        "AppleWebKit/537.36 (KHTML, like Gecko) "
-                        "Chrome/120.0.0.0 Safari/537.36"
-                    )
-                },
-                follow_redirects=True,
-                timeout=30.0
+        # One pooled client for image fetches and Claude calls so connections are kept alive
+        self._http = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+            timeout=30.0,
+            follow_redirects=True,
+            headers={
+                "User-Agent": (
+                    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+                    "AppleWebKit/537.36 (KHTML, like Gecko) "
+                    "Chrome/120.0.0.0 Safari/537.36"
+                )
+            }
+        )
+        self.client = AsyncAnthropic(api_key=self.api_key, http_client=self._http)
+
+        # Content-addressed result cache; an empty path disables it
+        cache_path = cache_path if cache_path is not None else os.getenv("VIBE_CACHE_PATH", ".vibe_cache.sqlite3")
+        self.cache = AnalysisCache(
+            cache_path,
+            url_ttl_seconds=float(os.getenv("VIBE_CACHE_URL_TTL_SECONDS", "3600"))
+        ) if cache_path else None
+
+        # Skip Claude for tiny/uniform images and near-duplicates (needs the image bytes)
+        self.prefilter = os.getenv("VIBE_PREFILTER", "1") == "1"
+
+        # Rate (token bucket) and in-flight limits for Claude calls, shared by every batch
+        self._rate_limiter = AsyncLimiter(
+            max_rate=float(os.getenv("ANTHROPIC_REQUESTS_PER_MINUTE", "50")),
+            time_period=60
+        )
+        self._concurrency = AdaptiveConcurrency(int(os.getenv("ANTHROPIC_MAX_CONCURRENCY", "3")))
+
+    @property
+    def http_client(self) -> httpx.AsyncClient:
+        """The pooled HTTP client, for sharing with other pipeline stages"""
+        return self._http
+
+    async def aclose(self):
+        """Close the pooled HTTP client and the result cache"""
+        await self._http.aclose()
+        if self.cache:
+            self.cache.close()
+
+    async def __aenter__(self) -> "VibeAnalyzer":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    async def _fetch_image(self, image_url: str) -> tuple[bytes, str]:
+        """Fetch an image, returning its raw bytes and media type"""
+        response = await self._http.get(image_url)
+        response.raise_for_status()
+
+        content_type = response.headers.get("content-type", "image/jpeg")
+        if "jpeg" in content_type or "jpg" in content_type:
+            media_type = "image/jpeg"
+        elif "png" in content_type:
+            media_type = "image/png"
+        elif "gif" in content_type:
+            media_type = "image/gif"
+        elif "webp" in content_type:
+            media_type = "image/webp"
+        else:
+            media_type = "image/jpeg"  # default assumption
+
+        return response.content, media_type
+
+    @staticmethod
+    def _url_block(image_url: str) -> dict:
+        """Build a Claude image content block that Anthropic fetches server-side"""
+        return {
+            "type": "image",
+            "source": {
+                "type": "url",
+                "url": image_url
+            }
+        }
+
+    @staticmethod
+    def _base64_block(image_bytes: bytes, media_type: str) -> dict:
+        """Build a Claude image content block from raw bytes"""
+        return {
+            "type": "image",
+            "source": {
+                "type": "base64",
+                "media_type": media_type,
+                "data": base64.standard_b64encode(image_bytes).decode("utf-8")
+            }
+        }
+
+    def _from_cache(self, image_url: str, digest: Optional[bytes] = None) -> Optional[VibeAnalysis]:
+        """Rehydrate a cached analysis by content hash, or by URL when no hash is given"""
+        if not self.cache:
+            return None
+        if digest is None:
+            digest = self.cache.hash_for_url(image_url)
+            if digest is None:
+                return None
+        cached = self.cache.get(digest)
+        if cached is None:
+            return None
+        try:
+            return VibeAnalysis(image_url=image_url, **cached)
+        except TypeError:
+            return None  # row from an older VibeAnalysis layout - treat as a miss
+
+    @staticmethod
+    def _inspect_image(image_bytes: bytes) -> tuple[Optional[str], Optional[imagehash.ImageHash]]:
+        """
+        Decode and perceptually hash an image (CPU-bound, run off the event loop)
+
+        Returns (skip reason, None) for images not worth sending to Claude, or
+        (None, phash) otherwise. Unreadable images get (None, None) so Claude
+        can still have a go at them.
+        """
+        try:
+            image = Image.open(BytesIO(image_bytes))
+            image.load()
+        except (UnidentifiedImageError, OSError):
+            return None, None
+
+        if min(image.size) < MIN_IMAGE_SIDE:
+            return "tiny", None
+
+        low, high = image.convert("L").getextrema()
+        if high - low < MIN_DYNAMIC_RANGE:
+            return "near-uniform", None
+
+        return None, imagehash.phash(image)
+
+    async def _prefilter(
+        self,
+        image_url: str,
+        image_bytes: bytes,
+        phash_index: dict
+    ) -> tuple[Optional[VibeAnalysis], Optional[imagehash.ImageHash]]:
+        """
+        Cheap local checks before paying for a Claude call
+
+        Returns (analysis, None) for images not worth sending, (analysis, phash)
+        for a near-duplicate of an image already analyzed in phash_index, or
+        (None, phash) when the image should go to Claude.
+        """
+        skip_reason, phash = await asyncio.to_thread(self._inspect_image, image_bytes)
+        if skip_reason:
+            description = "Image too small to analyze" if skip_reason == "tiny" else "Image too uniform to analyze"
+            return self._failed_analysis(image_url, description, f"Skipped: {skip_reason} image"), None
+        if phash is None:
+            return None, None
+
+        for prior_phash, prior in phash_index.items():
+            if phash - prior_phash <= PHASH_MAX_DISTANCE:
+                return replace(prior, image_url=image_url), phash
+        return None, phash
+
+    async def _screen_image(
+        self,
+        image_url: str,
+        phash_index: dict
+    ) -> tuple[Optional[VibeAnalysis], Optional[bytes], Optional[imagehash.ImageHash], Optional[dict]]:
+        """
+        Resolve an image without Claude where possible
+
+        Returns (analysis, ...) when the cache or pre-filter already decides the
+        image, otherwise (None, content hash, perceptual hash, image block) for the
+        caller to send to Claude. When the image was downloaded here the block
+        carries those bytes inline, so nobody fetches it twice; when caching and
+        pre-filtering are both disabled nothing is downloaded and the hashes and
+        block are None (send the URL instead).
+        """
+        # Repeat URLs within the TTL window skip the download entirely
+        cached = self._from_cache(image_url)
+        if cached:
+            return cached, None, None, None
+        if not self.cache and not self.prefilter:
+            return None, None, None, None
+
+        image_bytes, media_type = await self._fetch_image(image_url)
+
+        # Venues re-post the same images, so key the cache on content
+        digest = hashlib.sha256(image_bytes).digest()
+        if self.cache:
+            self.cache.remember_url(image_url, digest)
+            cached = self._from_cache(image_url, digest)
+            if cached:
+                return cached, digest, None, None
+
+        phash = None
+        if self.prefilter:
+            analysis, phash = await self._prefilter(image_url, image_bytes, phash_index)
+            if analysis:
+                return analysis, digest, phash, None
+        return None, digest, phash, self._base64_block(image_bytes, media_type)
+
+    def _remember_result(
+        self,
+        analysis: VibeAnalysis,
+        digest: Optional[bytes],
+        phash: Optional[imagehash.ImageHash],
+        phash_index: dict
+    ):
+        """Record a successful Claude analysis in the cache and the perceptual-hash index"""
+        if not analysis.success:
+            return
+        if self.cache and digest:
+            data = asdict(analysis)
+            del data["image_url"]
+            self.cache.put(digest, data)
+        if phash is not None:
+            phash_index[phash] = analysis
+
+    async def _ask_claude(self, image_blocks: list[dict], prompt: str, closer: str = "}") -> str:
+        """Send images and a prompt to Claude Vision, streaming so we can stop once the JSON closes"""
+        async with self._concurrency, self._rate_limiter:
+            try:
+                async with self.client.messages.stream(
+                    model="claude-sonnet-4-20250514",
+                    max_tokens=self.MAX_TOKENS_PER_IMAGE * len(image_blocks),
+                    # The prompt's format closes the JSON at column 0, so stop right there
+                    stop_sequences=[f"\n{closer}"],
+                    messages=[
+                        {
+                            "role": "user",
+                            "content": [
+                                *image_blocks,
+                                {
+                                    "type": "text",
+                                    "text": prompt
+                                }
+                            ]
+                        }
+                    ]
+                ) as stream:
+                    response_text = await self._read_json_stream(stream, closer)
+            except RateLimitError:
+                # Still rate limited after the SDK's retries - run fewer calls at once
+                await self._concurrency.backoff()
+                raise
+
+        await self._concurrency.recover()
+        return response_text
+
+    @staticmethod
+    def _is_url_fetch_error(error: BadRequestError) -> bool:
+        """Whether a 400 means Anthropic couldn't download an image URL (rather than a bad request)"""
+        message = str(error).lower()
+        return "url" in message or "download" in message
+
+    async def _ask_claude_about(
+        self,
+        image_urls: list[str],
+        prompt: str,
+        closer: str = "}",
+        blocks: Optional[list[Optional[dict]]] = None
+    ) -> str:
+        """
+        Ask Claude about images, passing URLs for any we haven't downloaded ourselves
+
+        blocks holds an already-built image block per URL (None where the image
+        wasn't downloaded). If Anthropic can't fetch a URL (e.g. it needs cookies
+        we hold), the request is retried once with the missing image bytes
+        downloaded and sent inline. Any other 400 is raised as-is.
+        """
+        if blocks is None:
+            blocks = [None] * len(image_urls)
+        try:
+            return await self._ask_claude(
+                [block or self._url_block(url) for url, block in zip(image_urls, blocks)],
+                prompt,
+                closer
             )
-            response.raise_for_status()
-
-            content_type = response.headers.get("content-type", "image/jpeg")
-            if "jpeg" in content_type or "jpg" in content_type:
-                media_type = "image/jpeg"
-            elif "png" in content_type:
-                media_type = "image/png"
-            elif "gif" in content_type:
-                media_type = "image/gif"
-            elif "webp" in content_type:
-                media_type = "image/webp"
-            else:
-                media_type = "image/jpeg"  # default assumption
-
-            base64_data = base64.standard_b64encode(response.content).decode("utf-8")
-            return base64_data, media_type
+        except BadRequestError as e:
+            if all(blocks) or not self._is_url_fetch_error(e):
+                raise
+
+        async def inline_block(url: str, block: Optional[dict]) -> dict:
+            if block:
+                return block
+            return self._base64_block(*await self._fetch_image(url))
+
+        blocks = await asyncio.gather(*(inline_block(url, block) for url, block in zip(image_urls, blocks)))
+        return await self._ask_claude(list(blocks), prompt, closer)
+
+    @staticmethod
+    def _strip_markdown(response_text: str) -> str:
+        """Remove any markdown code fence wrapped around the JSON"""
+        return _FENCE_RE.sub("", response_text).strip()
+
+    async def _read_json_stream(self, stream, closer: str = "}") -> str:
+        """Accumulate streamed text, stopping as soon as a complete JSON value arrives"""
+        chunks = []
+        async for delta in stream.text_stream:
+            chunks.append(delta)
+            if closer not in delta:
+                continue
+            text = "".join(chunks)
+            try:
+                orjson.loads(self._strip_markdown(text))
+                return text
+            except orjson.JSONDecodeError:
+                continue  # closing bracket of a nested value, keep reading
+
+        # Matched stop sequences aren't included in the text, so put the closer back
+        message = await stream.get_final_message()
+        if message.stop_reason == "stop_sequence":
+            chunks.append(f"\n{closer}")
+        return "".join(chunks)
+
+    @staticmethod
+    def _failed_analysis(image_url: str, description: str, error: str) -> VibeAnalysis:
+        """Neutral placeholder result for an image we couldn't analyze"""
+        return VibeAnalysis(
+            image_url=image_url,
+            energy_level=5,
+            crowd_level=5,
+            vibe_tags=["Unknown"],
+            description=description,
+            confidence=0.0,
+            success=False,
+            error=error
+        )
+
+    @staticmethod
+    def _analysis_from_data(data: dict, image_url: str) -> VibeAnalysis:
+        """Build a VibeAnalysis from one decoded JSON object, clamping scores to range"""
+        if not isinstance(data, dict):
+            raise TypeError(f"expected a JSON object, got {type(data).__name__}")
+        return VibeAnalysis(
+            image_url=image_url,
+            energy_level=max(1, min(10, int(data.get("energy_level", 5)))),
+            crowd_level=max(1, min(10, int(data.get("crowd_level", 5)))),
+            vibe_tags=data.get("vibe_tags", [])[:4],
+            description=data.get("description", "Unable to analyze"),
+            confidence=max(0.0, min(1.0, float(data.get("confidence", 0.5)))),
+            success=True
+        )
 
     def _parse_response(self, response_text: str, image_url: str) -> VibeAnalysis:
         """Parse Claude's JSON response into VibeAnalysis"""
         try:
             # Clean up response - remove any markdown formatting if present
-            text = response_text.strip()
-            if text.startswith("```"):
-                text = text.split("```")[1]
-                if text.startswith("json"):
-                    text = text[4:]
-            text = text.strip()
-
-            data = json.loads(text)
-
-            return VibeAnalysis(
-                image_url=image_url,
-                energy_level=max(1, min(10, int(data.get("energy_level", 5)))),
-                crowd_level=max(1, min(10, int(data.get("crowd_level", 5)))),
-                vibe_tags=data.get("vibe_tags", [])[:4],
-                description=data.get("description", "Unable to analyze"),
-                confidence=max(0.0, min(1.0, float(data.get("confidence", 0.5)))),
-                success=True
-            )
+            text = self._strip_markdown(response_text)
 
-        except (json.JSONDecodeError, KeyError, TypeError) as e:
-            return VibeAnalysis(
-                image_url=image_url,
-                energy_level=5,
-                crowd_level=5,
-                vibe_tags=["Unknown"],
-                description="Failed to parse analysis",
-                confidence=0.0,
-                success=False,
-                error=f"Parse error: {e}"
-            )
+            data = orjson.loads(text)
+
+            return self._analysis_from_data(data, image_url)
+
+        except (orjson.JSONDecodeError, KeyError, TypeError, ValueError) as e:
+            return self._failed_analysis(image_url, "Failed to parse analysis", f"Parse error: {e}")
 
-    async def analyze_image(self, image_url: str) -> VibeAnalysis:
+    def _parse_multi_response(self, response_text: str, image_urls: list[str]) -> Optional[list[VibeAnalysis]]:
+        """Parse a JSON array response, or None if it can't be mapped back to the images"""
+        try:
+            data = orjson.loads(self._strip_markdown(response_text))
+        except orjson.JSONDecodeError:
+            return None
+
+        if not isinstance(data, list) or len(data) != len(image_urls):
+            return None
+
+        analyses = []
+        for item, image_url in zip(data, image_urls):
+            try:
+                analyses.append(self._analysis_from_data(item, image_url))
+            except (AttributeError, KeyError, TypeError, ValueError) as e:
+                analyses.append(
+                    self._failed_analysis(image_url, "Failed to parse analysis", f"Parse error: {e}")
+                )
+        return analyses
+
+    async def analyze_image(self, image_url: str, phash_index: Optional[dict] = None) -> VibeAnalysis:
         """
         Analyze a single image URL using Claude Vision
 
         Args:
             image_url: URL of the image to analyze
+            phash_index: Perceptual hash -> analysis for images already seen at
+                         this venue; near-duplicates reuse those results
 
         Returns:
             VibeAnalysis with energy level, crowd level, and vibe tags
         """
         try:
-            # Fetch and encode image
-            base64_data, media_type = await self._fetch_image_as_base64(image_url)
-
-            # Call Claude Vision API
-            message = self.client.messages.create(
-                model="claude-sonnet-4-20250514",
-                max_tokens=500,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "image",
-                                "source": {
-                                    "type": "base64",
-                                    "media_type": media_type,
-                                    "data": base64_data
-                                }
-                            },
-                            {
-                                "type": "text",
-                                "text": self.VIBE_PROMPT
-                            }
-                        ]
-                    }
-                ]
-            )
+            if phash_index is None:
+                phash_index = {}
+            resolved, digest, phash, block = await self._screen_image(image_url, phash_index)
+            if resolved:
+                return resolved
 
-            response_text = message.content[0].text
-            return self._parse_response(response_text, image_url)
+            response_text = await self._ask_claude_about([image_url], self.VIBE_PROMPT, blocks=[block])
+
+            analysis = self._parse_response(response_text, image_url)
+            self._remember_result(analysis, digest, phash, phash_index)
+            return analysis
 
         except httpx.HTTPError as e:
-            return VibeAnalysis(
-                image_url=image_url,
-                energy_level=5,
-                crowd_level=5,
-                vibe_tags=["Unknown"],
-                description="Failed to fetch image",
-                confidence=0.0,
-                success=False,
-                error=f"HTTP error: {e}"
-            )
+            return self._failed_analysis(image_url, "Failed to fetch image", f"HTTP error: {e}")
 
         except Exception as e:
-            return VibeAnalysis(
-                image_url=image_url,
-                energy_level=5,
-                crowd_level=5,
-                vibe_tags=["Unknown"],
-                description="Analysis failed",
-                confidence=0.0,
-                success=False,
-                error=str(e)
-            )
+            return self._failed_analysis(image_url, "Analysis failed", str(e))
+
+    async def _analyze_group(self, image_urls: list[str], phash_index: dict) -> list[VibeAnalysis]:
+        """
+        Analyze a group of images with a single Claude request
+
+        If the model's answer can't be mapped back to the images, each one is
+        asked about separately, reusing the bytes already downloaded for it.
+        """
+        async def prepare(url: str):
+            """Return a finished analysis, or the (content hash, perceptual hash, image block) to send"""
+            try:
+                resolved, digest, phash, block = await self._screen_image(url, phash_index)
+            except httpx.HTTPError as e:
+                return self._failed_analysis(url, "Failed to fetch image", f"HTTP error: {e}")
+            except Exception as e:
+                return self._failed_analysis(url, "Analysis failed", str(e))
+            return resolved or (digest, phash, block)
+
+        async def ask_one(url: str, block: Optional[dict]) -> VibeAnalysis:
+            try:
+                response_text = await self._ask_claude_about([url], self.VIBE_PROMPT, blocks=[block])
+                return self._parse_response(response_text, url)
+            except Exception as e:
+                return self._failed_analysis(url, "Analysis failed", str(e))
+
+        results = list(await asyncio.gather(*(prepare(url) for url in image_urls)))
+        pending = [i for i, result in enumerate(results) if not isinstance(result, VibeAnalysis)]
+        if not pending:
+            return results
+
+        pending_urls = [image_urls[i] for i in pending]
+        blocks = [results[i][2] for i in pending]
+
+        if len(pending) == 1:
+            analyses = [await ask_one(pending_urls[0], blocks[0])]
+        else:
+            prompt = f"There are {len(pending_urls)} images.\n\n{self.MULTI_VIBE_PROMPT}"
+            try:
+                response_text = await self._ask_claude_about(pending_urls, prompt, closer="]", blocks=blocks)
+                analyses = self._parse_multi_response(response_text, pending_urls)
+            except Exception as e:
+                analyses = [self._failed_analysis(url, "Analysis failed", str(e)) for url in pending_urls]
+            if analyses is None:
+                # Model didn't return one object per image - ask about each separately
+                analyses = await asyncio.gather(*(ask_one(url, block) for url, block in zip(pending_urls, blocks)))
+
+        for i, analysis in zip(pending, analyses):
+            digest, phash, _ = results[i]
+            self._remember_result(analysis, digest, phash, phash_index)
+            results[i] = analysis
+        return results
+
+    async def analyze_multi(
+        self,
+        image_urls: list[str],
+        group_size: int = 4,
+        concurrency: int = 3,
+        phash_index: Optional[dict] = None
+    ) -> list[VibeAnalysis]:
+        """
+        Analyze multiple images, folding each group into a single Claude request
+
+        Args:
+            image_urls: List of image URLs to analyze
+            group_size: Images sent per request (4-6 keeps answers reliable)
+            concurrency: Max concurrent API calls (be mindful of rate limits)
+            phash_index: Shared near-duplicate index (see analyze_image); a new
+                         one is used for this call if not given
+
+        Returns:
+            List of VibeAnalysis results, in the same order as image_urls
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        if phash_index is None:
+            phash_index = {}
+
+        async def analyze_group_with_limit(urls: list[str]) -> list[VibeAnalysis]:
+            async with semaphore:
+                return await self._analyze_group(urls, phash_index)
+
+        groups = [image_urls[i:i + group_size] for i in range(0, len(image_urls), group_size)]
+        group_results = await asyncio.gather(*(analyze_group_with_limit(g) for g in groups))
+        return [analysis for group in group_results for analysis in group]
 
     async def analyze_batch(
         self,
         image_urls: list[str],
-        concurrency: int = 3
+        concurrency: int = 3,
+        phash_index: Optional[dict] = None
     ) -> list[VibeAnalysis]:
         """
         Analyze multiple images with controlled concurrency
@@ -206,41 +603,26 @@ Respond with ONLY the JSON object, nothing else."""
         Args:
             image_urls: List of image URLs to analyze
             concurrency: Max concurrent API calls (be mindful of rate limits)
+            phash_index: Shared near-duplicate index (see analyze_image); a new
+                         one is used for this call if not given
 
         Returns:
             List of VibeAnalysis results
         """
         semaphore = asyncio.Semaphore(concurrency)
+        if phash_index is None:
+            phash_index = {}
 
         async def analyze_with_limit(url: str) -> VibeAnalysis:
             async with semaphore:
-                result = await self.analyze_image(url)
-                # Small delay between requests to respect rate limits
-                await asyncio.sleep(0.5)
-                return result
+                return await self.analyze_image(url, phash_index)
 
         tasks = [analyze_with_limit(url) for url in image_urls]
         return await asyncio.gather(*tasks)
 
 
-def analysis_to_dict(analysis: VibeAnalysis) -> dict:
-    """Convert VibeAnalysis to JSON-serializable dict"""
-    return {
-        "image_url": analysis.image_url,
-        "energy_level": analysis.energy_level,
-        "crowd_level": analysis.crowd_level,
-        "vibe_tags": analysis.vibe_tags,
-        "description": analysis.description,
-        "confidence": analysis.confidence,
-        "success": analysis.success,
-        "error": analysis.error
-    }
-
-
 async def main():
     """CLI entry point for testing"""
-    import sys
-
     if len(sys.argv) < 2:
         print("Usage: python vibe_analyzer.py <image_url> [image_url2] ...")
         print("Example: python vibe_analyzer.py https://example.com/image.jpg")
@@ -256,14 +638,23 @@ async def main():
 
     print(f"Analyzing {len(image_urls)} image(s)...")
 
-    if len(image_urls) == 1:
-        result = await analyzer.analyze_image(image_urls[0])
-        print(json.dumps(analysis_to_dict(result), indent=2))
-    else:
-        results = await analyzer.analyze_batch(image_urls)
-        output = [analysis_to_dict(r) for r in results]
-        print(json.dumps(output, indent=2))
+    async with analyzer:
+        if len(image_urls) == 1:
+            result = await analyzer.analyze_image(image_urls[0])
+            output = orjson.dumps(result, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_DATACLASS)
+        else:
+            results = await analyzer.analyze_batch(image_urls)
+            output = orjson.dumps(results, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_DATACLASS)
+        print(output.decode("utf-8"))
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    # uvloop is optional; fall back to the default event loop without it
+    try:
+        import uvloop
+        loop_factory = uvloop.new_event_loop
+    except ImportError:
+        loop_factory = None
+
+    with asyncio.Runner(loop_factory=loop_factory) as runner:
+        runner.run(main())
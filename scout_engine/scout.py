@@ -5,12 +5,16 @@ Scrapes Instagram locations and analyzes vibes in one pipeline
 """
 
 import asyncio
-import json
+import heapq
 import os
 import sys
-from datetime import datetime
+from collections import Counter
+from dataclasses import replace
+from operator import itemgetter
 from typing import Optional
+from urllib.parse import urlsplit, urlunsplit
 
+import orjson
 from dotenv import load_dotenv
 
 # Add parent directory to path for imports
@@ -18,29 +22,64 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from scout_engine.scrapers.instagram_scraper import (
     InstagramLocationScraper,
-    ScrapeResult,
-    result_to_dict
+    MediaItem,
+    ScrapeResult
 )
 from scout_engine.analyzers.vibe_analyzer import (
     VibeAnalyzer,
-    VibeAnalysis,
-    analysis_to_dict
+    VibeAnalysis
 )
 
 load_dotenv()
 
 
+def _normalize_thumbnail_url(url: str) -> str:
+    """Strip query/fragment so CDN variants of the same image compare equal"""
+    parts = urlsplit(url)
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, "", ""))
+
+
 class ScoutEngine:
     """
     Complete Scout pipeline:
     1. Scrape Instagram location for recent media
     2. Analyze thumbnails with Claude Vision
     3. Return combined vibe report
+
+    Steps 1 and 2 overlap: thumbnails are sent for analysis in groups as
+    the scraper finds them, rather than after the scrape finishes.
     """
 
+    # Thumbnails per Claude request; a group is submitted as soon as it fills
+    ANALYSIS_GROUP_SIZE = 4
+
     def __init__(self, anthropic_api_key: Optional[str] = None):
-        self.scraper = InstagramLocationScraper()
         self.analyzer = VibeAnalyzer(api_key=anthropic_api_key)
+        self.scraper = InstagramLocationScraper(http_client=self.analyzer.http_client)
+
+    async def aclose(self):
+        """Release pooled connections held by the pipeline"""
+        await self.scraper.close()
+        await self.analyzer.aclose()
+
+    async def __aenter__(self) -> "ScoutEngine":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    async def _analyze_group(self, image_urls: list[str], phash_index: dict) -> list[VibeAnalysis]:
+        """Analyze one group of thumbnails, turning a crash into failed analyses rather than a lost report"""
+        try:
+            return await self.analyzer.analyze_multi(
+                image_urls,
+                group_size=self.ANALYSIS_GROUP_SIZE,
+                concurrency=2,
+                phash_index=phash_index
+            )
+        except Exception as e:
+            print(f"      Analysis of {len(image_urls)} images failed: {e}")
+            return [VibeAnalyzer._failed_analysis(url, "Analysis failed", str(e)) for url in image_urls]
 
     async def scout_location(
         self,
@@ -66,9 +105,53 @@ class ScoutEngine:
         print(f"Max posts: {max_posts}")
         print(f"{'='*60}\n")
 
-        # Step 1: Scrape the location
+        # Steps 1+2: Scrape the location, analyzing thumbnails with Claude Vision as posts arrive
+        pending_urls = []
+        analysis_tasks = []
+        seen_thumbnails = set()
+        phash_index = {}  # near-duplicate images are only analyzed once per venue
+
         print("[1/3] Scraping Instagram location...")
-        scrape_result = await self.scraper.scrape_location(location_url, max_posts)
+        if analyze_images:
+            print("[2/3] Analyzing vibes with Claude Vision as posts arrive...")
+        else:
+            print("[2/3] Skipping vibe analysis (disabled)")
+
+        async with asyncio.TaskGroup() as tg:
+            def submit_pending():
+                analysis_tasks.append(tg.create_task(self._analyze_group(pending_urls[:], phash_index)))
+                pending_urls.clear()
+
+            def queue_thumbnail(thumbnail_url: str):
+                # The CDN serves one image under several query strings, and browser
+                # retries can report a post twice - analyze each image once
+                key = _normalize_thumbnail_url(thumbnail_url)
+                if key in seen_thumbnails:
+                    return
+                seen_thumbnails.add(key)
+                pending_urls.append(thumbnail_url)
+                if len(pending_urls) >= self.ANALYSIS_GROUP_SIZE:
+                    submit_pending()
+
+            def on_media(item: MediaItem):
+                if analyze_images and item.thumbnail_url:
+                    queue_thumbnail(item.thumbnail_url)
+
+            scrape_result = await self.scraper.scrape_location(location_url, max_posts, on_media=on_media)
+
+            if not scrape_result.success:
+                for task in analysis_tasks:
+                    task.cancel()
+            else:
+                # The report covers the final posts only; pick up any the callback never saw
+                thumbnail_urls = [
+                    item.thumbnail_url for item in scrape_result.media_items
+                    if analyze_images and item.thumbnail_url
+                ]
+                for url in thumbnail_urls:
+                    queue_thumbnail(url)
+                if pending_urls:
+                    submit_pending()
 
         if not scrape_result.success:
             return {
@@ -91,26 +174,22 @@ class ScoutEngine:
                 "scraped_at": scrape_result.scraped_at
             }
 
-        # Step 2: Analyze thumbnails with Claude Vision
+        # Fan each distinct image's analysis back out to every post that showed it
+        results = {
+            _normalize_thumbnail_url(analysis.image_url): analysis
+            for task in analysis_tasks
+            for analysis in task.result()
+        }
         analyses = []
+        for url in thumbnail_urls:
+            analysis = results[_normalize_thumbnail_url(url)]
+            analyses.append(analysis if analysis.image_url == url else replace(analysis, image_url=url))
         if analyze_images:
-            print("[2/3] Analyzing vibes with Claude Vision...")
-
-            # Get thumbnail URLs
-            thumbnail_urls = [
-                item.thumbnail_url
-                for item in scrape_result.media_items
-                if item.thumbnail_url
-            ]
-
             if thumbnail_urls:
-                analyses = await self.analyzer.analyze_batch(thumbnail_urls, concurrency=2)
                 successful_analyses = [a for a in analyses if a.success]
                 print(f"      Analyzed {len(successful_analyses)}/{len(thumbnail_urls)} images")
             else:
                 print("      No thumbnails available for analysis")
-        else:
-            print("[2/3] Skipping vibe analysis (disabled)")
 
         # Step 3: Aggregate results
         print("[3/3] Generating vibe report...")
@@ -123,16 +202,8 @@ class ScoutEngine:
             "location_name": scrape_result.location_name,
             "post_count": len(scrape_result.media_items),
             "scraped_at": scrape_result.scraped_at,
-            "posts": [
-                {
-                    "url": item.url,
-                    "thumbnail_url": item.thumbnail_url,
-                    "media_type": item.media_type,
-                    "shortcode": item.shortcode
-                }
-                for item in scrape_result.media_items
-            ],
-            "analyses": [analysis_to_dict(a) for a in analyses] if analyses else [],
+            "posts": scrape_result.media_items,
+            "analyses": analyses,
             "vibe_summary": vibe_summary
         }
 
@@ -152,9 +223,17 @@ class ScoutEngine:
 
     def _aggregate_vibes(self, analyses: list[VibeAnalysis]) -> dict:
         """Aggregate multiple analyses into a summary"""
-        successful = [a for a in analyses if a.success and a.confidence > 0.3]
-
-        if not successful:
+        # Single pass over confident results: sum scores and count tags together
+        total_energy = total_crowd = sample_size = 0
+        tag_counts = Counter()
+        for analysis in analyses:
+            if analysis.success and analysis.confidence > 0.3:
+                total_energy += analysis.energy_level
+                total_crowd += analysis.crowd_level
+                sample_size += 1
+                tag_counts.update(analysis.vibe_tags)
+
+        if not sample_size:
             return {
                 "avg_energy": 5,
                 "avg_crowd": 5,
@@ -164,17 +243,11 @@ class ScoutEngine:
             }
 
         # Calculate averages
-        avg_energy = sum(a.energy_level for a in successful) / len(successful)
-        avg_crowd = sum(a.crowd_level for a in successful) / len(successful)
-
-        # Count vibe tags
-        tag_counts = {}
-        for analysis in successful:
-            for tag in analysis.vibe_tags:
-                tag_counts[tag] = tag_counts.get(tag, 0) + 1
+        avg_energy = total_energy / sample_size
+        avg_crowd = total_crowd / sample_size
 
         # Get top tags
-        top_tags = sorted(tag_counts.keys(), key=lambda t: tag_counts[t], reverse=True)[:4]
+        top_tags = [tag for tag, _ in heapq.nlargest(4, tag_counts.items(), key=itemgetter(1))]
 
         # Determine status
         if avg_energy >= 7 and avg_crowd >= 7:
@@ -189,7 +262,7 @@ class ScoutEngine:
             "avg_crowd": round(avg_crowd, 1),
             "top_vibe_tags": top_tags if top_tags else ["Unknown"],
             "status": status,
-            "sample_size": len(successful)
+            "sample_size": sample_size
         }
 
 
@@ -220,6 +293,8 @@ Required Environment Variables:
 
 Optional Environment Variables:
     PROXY_URL                Proxy server for scraping
+    IG_SESSIONID             Instagram session cookie for the location JSON endpoint
+    FORCE_BROWSER            Set to 1 to always scrape with Playwright
     SCRAPE_DELAY_SECONDS     Delay between requests (default: 3)
 """)
         sys.exit(1)
@@ -239,18 +314,22 @@ Optional Environment Variables:
             output_file = arg.split("=")[1]
 
     try:
-        engine = ScoutEngine()
-        report = await engine.scout_location(location_url, max_posts, analyze)
+        async with ScoutEngine() as engine:
+            report = await engine.scout_location(location_url, max_posts, analyze)
 
-        output_json = json.dumps(report, indent=2)
+        # orjson serializes the VibeAnalysis dataclasses in the report directly
+        output_bytes = orjson.dumps(
+            report,
+            option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_DATACLASS
+        )
 
         if output_file:
-            with open(output_file, "w") as f:
-                f.write(output_json)
+            with open(output_file, "wb") as f:
+                f.write(output_bytes)
             print(f"Report saved to: {output_file}")
         else:
             print("\nFull JSON Report:")
-            print(output_json)
+            print(output_bytes.decode("utf-8"))
 
     except ValueError as e:
         print(f"Configuration Error: {e}")
@@ -261,4 +340,12 @@ Optional Environment Variables:
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    # uvloop is optional; fall back to the default event loop without it
+    try:
+        import uvloop
+        loop_factory = uvloop.new_event_loop
+    except ImportError:
+        loop_factory = None
+
+    with asyncio.Runner(loop_factory=loop_factory) as runner:
+        runner.run(main())
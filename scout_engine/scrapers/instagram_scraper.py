@@ -1,22 +1,77 @@
 """
 Instagram Location Scraper for The Afters
-Scrapes recent media from Instagram location pages using Playwright
+Fetches recent media for Instagram locations from the web JSON endpoint,
+falling back to a Playwright browser scrape when that endpoint is blocked
 """
 
 import asyncio
-import json
 import os
 import random
 import re
 from dataclasses import dataclass
-from datetime import datetime
-from typing import Optional
+from datetime import datetime, timezone
+from typing import AsyncIterator, Callable, Optional
 
+import httpx
+import orjson
 from dotenv import load_dotenv
-from playwright.async_api import async_playwright, Page, Browser
+from playwright.async_api import async_playwright, Page, Browser, BrowserContext
 
 load_dotenv()
 
+USER_AGENT = (
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/120.0.0.0 Safari/537.36"
+)
+
+# App id the instagram.com web client sends with its API calls
+IG_APP_ID = "936619743392459"
+
+_LOCATION_ID_RE = re.compile(r"/locations/(\d+)")
+
+_BLOCKED_RESOURCE_TYPES = {"image", "media", "font", "stylesheet"}
+
+# Collects shortcode, thumbnail src and video overlay flag for the first N distinct
+# posts, stopping as soon as it has enough instead of visiting every link on the page
+_EXTRACT_POSTS_JS = """
+(limit) => {
+    const posts = [];
+    const seen = new Set();
+    for (const a of document.querySelectorAll('a[href*="/p/"]')) {
+        const match = /\\/p\\/([A-Za-z0-9_-]+)/.exec(a.getAttribute('href') || '');
+        if (!match || seen.has(match[1])) continue;
+        seen.add(match[1]);
+        posts.push({
+            shortcode: match[1],
+            img: a.querySelector('img')?.getAttribute('src') || '',
+            video: !!a.querySelector('svg[aria-label*="Video"], svg[aria-label*="Reel"]')
+        });
+        if (posts.length >= limit) break;
+    }
+    return posts;
+}
+"""
+
+# Maps shortcode -> thumbnail URL from the JSON payloads Instagram preloads into
+# <script type="application/json"> tags, for grid items rendered without an <img>
+_PRELOADED_THUMBNAILS_JS = """
+() => {
+    const thumbnails = {};
+    const walk = (node) => {
+        if (!node || typeof node !== 'object') return;
+        if (typeof node.code === 'string' && node.image_versions2?.candidates?.length) {
+            thumbnails[node.code] = thumbnails[node.code] || node.image_versions2.candidates[0].url;
+        }
+        for (const value of Object.values(node)) walk(value);
+    };
+    for (const script of document.querySelectorAll('script[type="application/json"]')) {
+        try { walk(JSON.parse(script.textContent)); } catch (e) {}
+    }
+    return thumbnails;
+}
+"""
+
 
 @dataclass
 class MediaItem:
@@ -42,10 +97,75 @@ class ScrapeResult:
 class InstagramLocationScraper:
     """Scrapes Instagram location pages for recent media"""
 
-    def __init__(self, proxy_url: Optional[str] = None):
+    WEB_INFO_URL = "https://www.instagram.com/api/v1/locations/web_info/"
+
+    def __init__(
+        self,
+        proxy_url: Optional[str] = None,
+        http_client: Optional[httpx.AsyncClient] = None
+    ):
         self.proxy_url = proxy_url or os.getenv("PROXY_URL")
         self.scrape_delay = float(os.getenv("SCRAPE_DELAY_SECONDS", "3"))
         self.max_retries = int(os.getenv("MAX_RETRIES", "3"))
+        self.session_id = os.getenv("IG_SESSIONID")
+        self.force_browser = os.getenv("FORCE_BROWSER") == "1"
+
+        # Proxies are bound when a client is created, so only share a client without one
+        self._owns_http = http_client is None or bool(self.proxy_url)
+        if self._owns_http:
+            self._http = httpx.AsyncClient(
+                proxy=self.proxy_url,
+                timeout=30.0,
+                follow_redirects=True
+            )
+        else:
+            self._http = http_client
+
+        # Browser is launched lazily and reused across scrapes until close()
+        self._playwright = None
+        self._browser: Optional[Browser] = None
+        self._context: Optional[BrowserContext] = None
+        self._browser_lock = asyncio.Lock()
+
+    async def close(self):
+        """Shut down the browser and close the HTTP client if this scraper created it"""
+        await self._close_browser()
+        if self._owns_http:
+            await self._http.aclose()
+
+    async def _get_context(self) -> BrowserContext:
+        """Return the shared stealth context, (re)launching the browser if it isn't running"""
+        async with self._browser_lock:
+            if self._browser and not self._browser.is_connected():
+                print("Browser disconnected - relaunching")
+                await self._stop_browser()
+            if self._context is None:
+                self._browser, self._playwright = await self._setup_browser()
+                try:
+                    self._context = await self._create_stealth_context(self._browser)
+                except Exception:
+                    # Don't leave a half-built browser behind for the next call to orphan
+                    await self._stop_browser()
+                    raise
+            return self._context
+
+    async def _close_browser(self):
+        """Close the shared browser and stop Playwright, if running"""
+        async with self._browser_lock:
+            await self._stop_browser()
+
+    async def _stop_browser(self):
+        """Tear down the browser and Playwright; callers must hold _browser_lock"""
+        if self._browser:
+            try:
+                await self._browser.close()
+            except Exception:
+                pass  # already gone
+        if self._playwright:
+            await self._playwright.stop()
+        self._playwright = None
+        self._browser = None
+        self._context = None
 
     async def _setup_browser(self) -> tuple[Browser, any]:
         """Set up Playwright browser with anti-detection measures"""
@@ -72,11 +192,7 @@ class InstagramLocationScraper:
         """Create a browser context with realistic fingerprints"""
         context = await browser.new_context(
             viewport={"width": 1920, "height": 1080},
-            user_agent=(
-                "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
-                "AppleWebKit/537.36 (KHTML, like Gecko) "
-                "Chrome/120.0.0.0 Safari/537.36"
-            ),
+            user_agent=USER_AGENT,
             locale="en-US",
             timezone_id="America/Los_Angeles",
         )
@@ -100,66 +216,67 @@ class InstagramLocationScraper:
             );
         """)
 
+        # We only read hrefs and src attributes, so skip downloading the heavy assets
+        await context.route("**/*", self._block_heavy_resources)
+
         return context
 
-    async def _extract_media_from_page(self, page: Page, max_items: int = 10) -> list[MediaItem]:
-        """Extract media URLs from loaded Instagram location page"""
-        media_items = []
+    @staticmethod
+    async def _block_heavy_resources(route):
+        """Abort image/media/font/stylesheet requests, let everything else through"""
+        if route.request.resource_type in _BLOCKED_RESOURCE_TYPES:
+            await route.abort()
+        else:
+            await route.continue_()
+
+    async def _iter_media_from_page(self, page: Page, max_items: int = 10) -> AsyncIterator[MediaItem]:
+        """Yield media items from the loaded Instagram location page as they are extracted"""
+        missing_thumbnails = []
+        # Everything on the page is scraped within the same moment - stamp it once
+        scraped_at = datetime.now(timezone.utc).isoformat()
 
         # Wait for posts to load
         await page.wait_for_timeout(2000)
 
         # Try to find post links - Instagram uses article elements or divs with specific structure
-        # The posts are typically in a grid layout
-        post_links = await page.query_selector_all('a[href*="/p/"]')
-
-        seen_shortcodes = set()
-
-        for link in post_links[:max_items * 2]:  # Get extra in case of duplicates
-            if len(media_items) >= max_items:
-                break
-
-            try:
-                href = await link.get_attribute("href")
-                if not href:
-                    continue
-
-                # Extract shortcode from URL
-                match = re.search(r'/p/([A-Za-z0-9_-]+)', href)
-                if not match:
-                    continue
-
-                shortcode = match.group(1)
-
-                if shortcode in seen_shortcodes:
-                    continue
-                seen_shortcodes.add(shortcode)
-
-                # Try to get thumbnail image from within the link
-                img = await link.query_selector("img")
-                thumbnail_url = ""
-                if img:
-                    thumbnail_url = await img.get_attribute("src") or ""
-
-                # Determine if it's a video (look for video icon overlay)
-                video_indicator = await link.query_selector('svg[aria-label*="Video"], svg[aria-label*="Reel"]')
-                media_type = "video" if video_indicator else "image"
-
-                # Construct full URL
-                full_url = f"https://www.instagram.com/p/{shortcode}/"
-
-                media_items.append(MediaItem(
-                    url=full_url,
-                    thumbnail_url=thumbnail_url,
-                    media_type=media_type,
-                    shortcode=shortcode,
-                    scraped_at=datetime.utcnow().isoformat()
-                ))
-
-            except Exception as e:
-                print(f"Error extracting media item: {e}")
-                continue
-
+        # The posts are typically in a grid layout. Read the first max_items distinct posts
+        # in one page.evaluate call rather than several CDP round trips per link.
+        posts = await page.evaluate(_EXTRACT_POSTS_JS, max_items)
+
+        for post in posts:
+            shortcode = post["shortcode"]
+            item = MediaItem(
+                url=f"https://www.instagram.com/p/{shortcode}/",
+                thumbnail_url=post["img"],
+                media_type="video" if post["video"] else "image",
+                shortcode=shortcode,
+                scraped_at=scraped_at
+            )
+
+            if item.thumbnail_url:
+                yield item
+            else:
+                missing_thumbnails.append(item)
+
+        # Thumbnails not in the grid markup can usually be found in the preloaded JSON
+        if missing_thumbnails:
+            thumbnails = await page.evaluate(_PRELOADED_THUMBNAILS_JS)
+            for item in missing_thumbnails:
+                item.thumbnail_url = thumbnails.get(item.shortcode, "")
+                yield item
+
+    async def _collect_media(
+        self,
+        page: Page,
+        max_items: int,
+        on_media: Optional[Callable[[MediaItem], None]]
+    ) -> list[MediaItem]:
+        """Collect media items from the page, handing each to on_media as soon as it is found"""
+        media_items = []
+        async for item in self._iter_media_from_page(page, max_items):
+            media_items.append(item)
+            if on_media:
+                on_media(item)
         return media_items
 
     async def _get_location_name(self, page: Page) -> Optional[str]:
@@ -173,84 +290,218 @@ class InstagramLocationScraper:
             pass
         return None
 
-    async def scrape_location(self, location_url: str, max_items: int = 10) -> ScrapeResult:
+    @staticmethod
+    def _media_from_api(media: dict, scraped_at: str) -> Optional[MediaItem]:
+        """Convert one media object from the web_info JSON into a MediaItem"""
+        shortcode = media.get("code")
+        if not shortcode:
+            return None
+
+        # Carousels keep their images on the child items
+        source = media
+        if not media.get("image_versions2") and media.get("carousel_media"):
+            source = media["carousel_media"][0]
+        candidates = (source.get("image_versions2") or {}).get("candidates") or []
+        thumbnail_url = candidates[0].get("url", "") if candidates else ""
+
+        return MediaItem(
+            url=f"https://www.instagram.com/p/{shortcode}/",
+            thumbnail_url=thumbnail_url,
+            media_type="video" if media.get("media_type") == 2 else "image",
+            shortcode=shortcode,
+            scraped_at=scraped_at
+        )
+
+    async def _scrape_via_api(self, location_url: str, max_items: int) -> Optional[ScrapeResult]:
+        """
+        Fetch recent media straight from Instagram's location JSON endpoint
+
+        Returns None when the endpoint can't be used (login wall, 403,
+        unexpected payload, no media) so the caller can fall back to the browser.
+        """
+        match = _LOCATION_ID_RE.search(location_url)
+        if not match:
+            return None
+
+        headers = {
+            "User-Agent": USER_AGENT,
+            "X-IG-App-ID": IG_APP_ID,
+            "Referer": location_url,
+        }
+        if self.session_id:
+            headers["Cookie"] = f"sessionid={self.session_id}"
+
+        try:
+            print(f"Fetching location JSON: {match.group(1)}")
+            response = await self._http.get(
+                self.WEB_INFO_URL,
+                params={"location_id": match.group(1)},
+                headers=headers
+            )
+        except httpx.HTTPError as e:
+            print(f"Location JSON request failed: {e}")
+            return None
+
+        if response.status_code != 200 or "json" not in response.headers.get("content-type", ""):
+            print(f"Location JSON unavailable (HTTP {response.status_code}) - falling back to browser")
+            return None
+
+        try:
+            data = orjson.loads(response.content)
+        except orjson.JSONDecodeError:
+            return None
+
+        location = data.get("native_location_data") if isinstance(data, dict) else None
+        if not location:
+            print("Location JSON missing media - falling back to browser")
+            return None
+
+        scraped_at = datetime.now(timezone.utc).isoformat()
+        media_items = []
+        # Holds at most max_items entries, reusing the shortcode strings from the parsed JSON
+        seen_shortcodes = set()
+        for section in (location.get("recent") or {}).get("sections") or []:
+            for entry in (section.get("layout_content") or {}).get("medias") or []:
+                media = entry.get("media") or {}
+                if media.get("code") in seen_shortcodes:
+                    continue  # skip repeats before building anything for them
+                item = self._media_from_api(media, scraped_at)
+                if not item:
+                    continue
+                seen_shortcodes.add(item.shortcode)
+                media_items.append(item)
+                if len(media_items) >= max_items:
+                    break
+            if len(media_items) >= max_items:
+                break
+
+        if not media_items:
+            print("Location JSON has no recent media - falling back to browser")
+            return None
+
+        return ScrapeResult(
+            location_url=location_url,
+            location_name=(location.get("location_info") or {}).get("name"),
+            media_items=media_items,
+            scraped_at=scraped_at,
+            success=True
+        )
+
+    async def scrape_location(
+        self,
+        location_url: str,
+        max_items: int = 10,
+        on_media: Optional[Callable[[MediaItem], None]] = None
+    ) -> ScrapeResult:
         """
         Scrape recent media from an Instagram location page
 
+        Tries the location JSON endpoint first (a single HTTP request) and only
+        launches a browser if that fails or FORCE_BROWSER=1 is set.
+
         Args:
             location_url: Full Instagram location URL
                          (e.g., https://www.instagram.com/explore/locations/123456/venue-name/)
             max_items: Maximum number of media items to scrape (default 10)
+            on_media: Optional callback invoked with each MediaItem as soon as it
+                      is found, so callers can start work before the scrape ends.
+                      Browser retries may report the same item more than once.
 
         Returns:
             ScrapeResult with media items or error
         """
-        browser = None
-        playwright = None
-
+        if not self.force_browser:
+            result = await self._scrape_via_api(location_url, max_items)
+            if result is not None:
+                if on_media:
+                    for item in result.media_items:
+                        on_media(item)
+                return result
+
+        return await self._scrape_via_browser(location_url, max_items, on_media)
+
+    async def _scrape_page(
+        self,
+        location_url: str,
+        max_items: int,
+        on_media: Optional[Callable[[MediaItem], None]]
+    ) -> Optional[ScrapeResult]:
+        """Load the location page once in a new tab; returns None if Instagram rate limited us"""
+        context = await self._get_context()
+        page = await context.new_page()
+        try:
+            # Navigate to location page
+            response = await page.goto(location_url, wait_until="domcontentloaded", timeout=30000)
+
+            if response and response.status == 429:
+                return None
+
+            if response and response.status != 200:
+                raise Exception(f"HTTP {response.status}")
+
+            # Check for login wall
+            login_wall = await page.query_selector('input[name="username"]')
+            if login_wall:
+                print("Login wall detected - Instagram is blocking anonymous access")
+                raise Exception("Login required - Instagram blocking anonymous scraping")
+
+            # Extract media items first so on_media consumers can get started
+            media_items = await self._collect_media(page, max_items, on_media)
+
+            if not media_items:
+                # Try scrolling to load more content
+                await page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
+                await page.wait_for_timeout(2000)
+                media_items = await self._collect_media(page, max_items, on_media)
+
+            # Extract location name
+            location_name = await self._get_location_name(page)
+
+            return ScrapeResult(
+                location_url=location_url,
+                location_name=location_name,
+                media_items=media_items,
+                scraped_at=datetime.now(timezone.utc).isoformat(),
+                success=True
+            )
+        finally:
+            try:
+                await page.close()
+            except Exception:
+                pass  # browser went away with the page
+
+    async def _scrape_via_browser(
+        self,
+        location_url: str,
+        max_items: int,
+        on_media: Optional[Callable[[MediaItem], None]] = None
+    ) -> ScrapeResult:
+        """Scrape the location page with a stealth Playwright browser, retrying on failure"""
         for attempt in range(self.max_retries):
             try:
-                browser, playwright = await self._setup_browser()
-                context = await self._create_stealth_context(browser)
-                page = await context.new_page()
-
                 # Add random delay to seem more human
                 await asyncio.sleep(random.uniform(1, self.scrape_delay))
 
-                # Navigate to location page
                 print(f"Navigating to: {location_url} (attempt {attempt + 1})")
-                response = await page.goto(location_url, wait_until="networkidle", timeout=30000)
+                result = await self._scrape_page(location_url, max_items, on_media)
 
-                if response and response.status == 429:
+                if result is None:
                     print("Rate limited! Waiting before retry...")
                     await asyncio.sleep(30 * (attempt + 1))
                     continue
 
-                if response and response.status != 200:
-                    raise Exception(f"HTTP {response.status}")
-
-                # Check for login wall
-                login_wall = await page.query_selector('input[name="username"]')
-                if login_wall:
-                    print("Login wall detected - Instagram is blocking anonymous access")
-                    raise Exception("Login required - Instagram blocking anonymous scraping")
-
-                # Extract location name
-                location_name = await self._get_location_name(page)
-
-                # Extract media items
-                media_items = await self._extract_media_from_page(page, max_items)
-
-                if not media_items:
-                    # Try scrolling to load more content
-                    await page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
-                    await page.wait_for_timeout(2000)
-                    media_items = await self._extract_media_from_page(page, max_items)
-
-                await browser.close()
-                await playwright.stop()
-
-                return ScrapeResult(
-                    location_url=location_url,
-                    location_name=location_name,
-                    media_items=media_items,
-                    scraped_at=datetime.utcnow().isoformat(),
-                    success=True
-                )
+                return result
 
             except Exception as e:
+                # The shared browser is only relaunched if it has disconnected (see _get_context)
                 print(f"Attempt {attempt + 1} failed: {e}")
-                if browser:
-                    await browser.close()
-                if playwright:
-                    await playwright.stop()
 
                 if attempt == self.max_retries - 1:
                     return ScrapeResult(
                         location_url=location_url,
                         location_name=None,
                         media_items=[],
-                        scraped_at=datetime.utcnow().isoformat(),
+                        scraped_at=datetime.now(timezone.utc).isoformat(),
                         success=False,
                         error=str(e)
                     )
@@ -262,33 +513,12 @@ class InstagramLocationScraper:
             location_url=location_url,
             location_name=None,
             media_items=[],
-            scraped_at=datetime.utcnow().isoformat(),
+            scraped_at=datetime.now(timezone.utc).isoformat(),
             success=False,
             error="Max retries exceeded"
         )
 
 
-def result_to_dict(result: ScrapeResult) -> dict:
-    """Convert ScrapeResult to JSON-serializable dict"""
-    return {
-        "location_url": result.location_url,
-        "location_name": result.location_name,
-        "media_items": [
-            {
-                "url": item.url,
-                "thumbnail_url": item.thumbnail_url,
-                "media_type": item.media_type,
-                "shortcode": item.shortcode,
-                "scraped_at": item.scraped_at
-            }
-            for item in result.media_items
-        ],
-        "scraped_at": result.scraped_at,
-        "success": result.success,
-        "error": result.error
-    }
-
-
 async def main():
     """CLI entry point for testing"""
     import sys
@@ -302,10 +532,21 @@ async def main():
     max_items = int(sys.argv[2]) if len(sys.argv) > 2 else 10
 
     scraper = InstagramLocationScraper()
-    result = await scraper.scrape_location(location_url, max_items)
+    try:
+        result = await scraper.scrape_location(location_url, max_items)
+    finally:
+        await scraper.close()
 
-    print(json.dumps(result_to_dict(result), indent=2))
+    print(orjson.dumps(result, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_DATACLASS).decode("utf-8"))
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    # uvloop is optional; fall back to the default event loop without it
+    try:
+        import uvloop
+        loop_factory = uvloop.new_event_loop
+    except ImportError:
+        loop_factory = None
+
+    with asyncio.Runner(loop_factory=loop_factory) as runner:
+        runner.run(main())
@@ -0,0 +1,89 @@
+"""
+Analysis Cache for The Afters
+Content-addressed SQLite store so repeat thumbnails skip the download and the Claude call
+"""
+
+import sqlite3
+import time
+from typing import Optional
+
+import orjson
+
+
+class AnalysisCache:
+    """
+    Maps image content hashes to analysis results, with a URL -> hash shortcut
+
+    Each write is its own short transaction so concurrent runs sharing the file
+    never hold the write lock for long. WAL with synchronous=NORMAL keeps those
+    commits cheap (no fsync per write). Database errors are treated as cache
+    misses - a locked or broken cache must never fail an analysis.
+    """
+
+    def __init__(self, path: str, url_ttl_seconds: float = 3600):
+        self.path = path
+        self.url_ttl_seconds = url_ttl_seconds
+        # Autocommit mode: nothing opens an implicit transaction that outlives a write
+        self._db = sqlite3.connect(path, timeout=1.0, isolation_level=None)
+        self._db.executescript("""
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS analyses (
+                hash BLOB PRIMARY KEY,
+                json TEXT NOT NULL,
+                ts REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS urls (
+                url TEXT PRIMARY KEY,
+                hash BLOB NOT NULL,
+                ts REAL NOT NULL
+            );
+        """)
+
+    def _fetchone(self, sql: str, params: tuple) -> Optional[tuple]:
+        try:
+            return self._db.execute(sql, params).fetchone()
+        except sqlite3.Error as e:
+            print(f"Cache read failed: {e}")
+            return None
+
+    def _write(self, sql: str, params: tuple):
+        try:
+            self._db.execute(sql, params)
+        except sqlite3.Error as e:
+            print(f"Cache write failed: {e}")
+
+    def get(self, digest: bytes) -> Optional[dict]:
+        """Return the cached analysis fields for an image hash"""
+        row = self._fetchone("SELECT json FROM analyses WHERE hash = ?", (digest,))
+        if not row:
+            return None
+        try:
+            return orjson.loads(row[0])
+        except orjson.JSONDecodeError:
+            return None
+
+    def put(self, digest: bytes, data: dict):
+        """Store analysis fields for an image hash"""
+        self._write(
+            "INSERT OR REPLACE INTO analyses (hash, json, ts) VALUES (?, ?, ?)",
+            (digest, orjson.dumps(data).decode("utf-8"), time.time())
+        )
+
+    def hash_for_url(self, url: str) -> Optional[bytes]:
+        """Return the content hash last seen at this URL, if still within the TTL"""
+        row = self._fetchone(
+            "SELECT hash FROM urls WHERE url = ? AND ts >= ?",
+            (url, time.time() - self.url_ttl_seconds)
+        )
+        return row[0] if row else None
+
+    def remember_url(self, url: str, digest: bytes):
+        """Record which content hash a URL served"""
+        self._write(
+            "INSERT OR REPLACE INTO urls (url, hash, ts) VALUES (?, ?, ?)",
+            (url, digest, time.time())
+        )
+
+    def close(self):
+        self._db.close()
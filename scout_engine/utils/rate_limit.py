@@ -0,0 +1,45 @@
+"""
+Adaptive Concurrency for The Afters
+Caps in-flight API calls, shrinking the cap when the API rate limits us
+"""
+
+import asyncio
+
+
+class AdaptiveConcurrency:
+    """
+    Async context manager limiting concurrent calls to a cap that can change at runtime
+
+    The cap halves on backoff() and grows back by one on each recover(), up to
+    the configured maximum. Waiters sit on a Condition, so changing the cap
+    never has to touch semaphore internals.
+    """
+
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max_concurrency
+        self.limit = max_concurrency
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self) -> "AdaptiveConcurrency":
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    async def backoff(self):
+        """Halve the cap after a rate limit response"""
+        async with self._condition:
+            self.limit = max(1, self.limit // 2)
+
+    async def recover(self):
+        """Raise the cap by one after a successful call"""
+        async with self._condition:
+            if self.limit < self.max_concurrency:
+                self.limit += 1
+                self._condition.notify_all()